@@ -5,10 +5,29 @@ from django.db.transaction import (
     commit, rollback, savepoint, savepoint_commit, savepoint_rollback
 )
 
+from . import _atomic
+from ._atomic import Atomic
+from ._cache import cached_get
+from .chunks import atomic_chunks, process_chunks
+from .groupcommit import GroupCommitExecutor
+from .locks import LockTimeoutError, get_lock_stats, lock_rows, lock_waited
+from .trace import start_recording, stop_recording
+
 try:
     # This is what we provide if missing...
-    from django.db.transaction import atomic
+    from django.db.transaction import atomic as _builtin_atomic
 
 except ImportError:
     # Import our implementation.
     from ._atomic import *
+    _builtin_atomic = None
+
+
+def atomic(using=None, savepoint=True, **extensions):
+    """
+    Django's atomic() when it has one, our implementation when it doesn't or
+    when extensions (cache_reads, durable, lock, ...) are used. See Atomic.
+    """
+    if _builtin_atomic is None or extensions:
+        return _atomic.atomic(using, savepoint, **extensions)
+    return _builtin_atomic(using, savepoint)
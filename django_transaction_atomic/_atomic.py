@@ -1,16 +1,28 @@
-# Django 1.11.15 stock implementation... Only change is to get_connection()
+# Django 1.11.15 stock implementation... Changes are to get_connection() and
+# the opt-in extensions to Atomic.
 from __future__ import absolute_import
 
+import os
+import traceback
+
+from django.conf import settings
 from django.db import (
     DEFAULT_DB_ALIAS, DatabaseError, connections,
 )
+from ._cache import ReadCache
 from ._compat import (
-    ContextDecorator, Error, ProgrammingError, ProxyDatabaseWrapper
+    ContextDecorator, Error, ProgrammingError, ProxyDatabaseWrapper,
+    TransactionManagementError as _TransactionManagementError
 )
+from .locks import acquire_lock, release_lock
+from .routers import record_commit
+from . import trace
 
-class TransactionManagementError(ProgrammingError):
+class TransactionManagementError(_TransactionManagementError,
+                                 ProgrammingError):
     """
     This exception is thrown when transaction management is used improperly.
+    Subclasses Django's, so that either can be caught.
     """
     pass
 
@@ -95,16 +107,64 @@ class Atomic(ContextDecorator):
 
     Since database connections are thread-local, this is thread-safe.
 
+    With `cache_reads=True`, instances fetched through `cached_get()` are kept
+    in a ReadCache until this block exits. See ReadCache for invalidation.
+
+    With `durable=True`, entering the block inside another atomic block raises
+    TransactionManagementError instead of creating a savepoint. When DEBUG is
+    on, the error includes the stack where the outermost block was entered.
+
+    With `lock='name'`, the named advisory lock is acquired before the
+    transaction begins, waiting at most `lock_timeout` seconds, and released
+    after it ends. Such a block must be the outermost block as well.
+
+    With `statement_timeout` and `lock_wait_timeout`, in seconds, the session
+    limits of the outermost block are set when it begins and restored when it
+    ends: max_execution_time and innodb_lock_wait_timeout on MySQL, the busy
+    timeout on SQLite. Nested blocks can't change them.
+
     This is a private API.
     """
+    # Disabled by TestCase, which wraps tests in atomic blocks.
+    _ensure_durability = True
 
-    def __init__(self, using, savepoint):
+    def __init__(self, using, savepoint, cache_reads=False, durable=False,
+                 lock=None, lock_timeout=None, statement_timeout=None,
+                 lock_wait_timeout=None):
         self.using = using
         self.savepoint = savepoint
+        self.cache_reads = cache_reads
+        self.durable = durable
+        self.lock = lock
+        self.lock_timeout = lock_timeout
+        self.statement_timeout = statement_timeout
+        self.lock_wait_timeout = lock_wait_timeout
 
     def __enter__(self):
         connection = get_connection(self.using)
 
+        if ((self.durable or self.lock is not None) and
+                self._ensure_durability and connection.in_atomic_block):
+            message = ("A %s atomic block cannot be nested within another "
+                       "atomic block." % ('durable' if self.durable
+                                          else 'locked'))
+            if connection.atomic_entry_stack:
+                message += ("\nThe outermost atomic block was entered at:\n" +
+                            ''.join(connection.atomic_entry_stack))
+            raise TransactionManagementError(message)
+
+        if self.lock is None:
+            return self._enter(connection)
+
+        acquire_lock(connection, self.lock, self.lock_timeout)
+        try:
+            self._enter(connection)
+        except Exception:
+            release_lock(connection, self.lock)
+            raise
+
+    def _enter(self, connection):
+        outermost = False
         if not connection.in_atomic_block:
             # Reset state when entering an outermost atomic block.
             connection.commit_on_exit = True
@@ -135,12 +195,47 @@ class Atomic(ContextDecorator):
             else:
                 connection.savepoint_ids.append(None)
         else:
-            connection.set_autocommit(
-                False, force_begin_transaction_with_broken_autocommit=True)
+            try:
+                if (self.statement_timeout is not None or
+                        self.lock_wait_timeout is not None):
+                    self._set_timeouts(connection)
+                connection.set_autocommit(
+                    False, force_begin_transaction_with_broken_autocommit=True)
+            except Exception:
+                # __exit__ won't run, restore the values set so far.
+                self._restore_timeouts(connection)
+                raise
             connection.in_atomic_block = True
+            outermost = True
+
+        if self.cache_reads and connection.read_cache is None:
+            connection.read_cache = ReadCache()
+        _block_entered(connection, outermost)
+
+    def _set_timeouts(self, connection):
+        # Remember the previous values, restored in __exit__.
+        connection.atomic_timeouts = []
+        for name, value in connection.get_timeout_variables(
+                self.statement_timeout, self.lock_wait_timeout):
+            connection.atomic_timeouts.append(
+                (name, connection.get_session_variable(name)))
+            connection.set_session_variable(name, value)
+
+    def _restore_timeouts(self, connection):
+        timeouts = connection.atomic_timeouts
+        connection.atomic_timeouts = None
+        if timeouts and connection.connection is not None:
+            try:
+                for name, value in timeouts:
+                    connection.set_session_variable(name, value)
+            except Error:
+                # Start over with a new session, and its defaults.
+                connection.close()
 
     def __exit__(self, exc_type, exc_value, traceback):
         connection = get_connection(self.using)
+        committed = False
+        sid = None
 
         if connection.savepoint_ids:
             sid = connection.savepoint_ids.pop()
@@ -185,6 +280,7 @@ class Atomic(ContextDecorator):
                             # went wrong with the connection. Drop it.
                             connection.close()
                         raise
+                committed = True
             else:
                 # This flag will be set to True again if there isn't a
                 # savepoint allowing to perform the rollback at this level.
@@ -215,8 +311,15 @@ class Atomic(ContextDecorator):
                         connection.close()
 
         finally:
+            _block_exited(connection, committed, sid)
+
+            # The transaction has ended, release_lock() never raises.
+            if self.lock is not None:
+                release_lock(connection, self.lock)
+
             # Outermost block exit when autocommit was enabled.
             if not connection.in_atomic_block:
+                self._restore_timeouts(connection)
                 if connection.closed_in_transaction:
                     connection.connection = None
                 else:
@@ -230,14 +333,119 @@ class Atomic(ContextDecorator):
                     connection.in_atomic_block = False
 
 
-def atomic(using=None, savepoint=True):
+def _entry_stack():
+    # The stack of the code entering the block, without this module's frames.
+    stack = traceback.extract_stack()
+    module = os.path.splitext(__file__)[0]
+    while stack and os.path.splitext(stack[-1][0])[0] == module:
+        stack.pop()
+    return traceback.format_list(stack)
+
+
+def _block_entered(connection, outermost):
+    """
+    Sets up the state of the extensions for a block that was entered, by
+    Atomic or by Django's own Atomic.
+    """
+    if outermost:
+        # Models written in this transaction, see routers.
+        connection.atomic_writes = set()
+        # Rows locked in this transaction, see locks.
+        connection.locked_rows = set()
+        if settings.DEBUG:
+            connection.atomic_entry_stack = _entry_stack()
+        recorder = trace.get_recorder()
+        if recorder is not None:
+            connection.atomic_trace = recorder.begin(connection)
+    elif (connection.atomic_trace is not None and
+            connection.savepoint_ids[-1] is not None):
+        # Blocks without a savepoint are invisible to the database.
+        connection.atomic_trace.event('savepoint')
+
+    if connection.read_cache is not None:
+        connection.read_cache.enter_block()
+
+
+def _block_exited(connection, committed, sid):
+    """
+    Tears down the state of the extensions for a block that was exited, by
+    Atomic or by Django's own Atomic.
+    """
+    outermost = not connection.in_atomic_block
+
+    # The read cache never outlives the block that created it.
+    if connection.read_cache is not None:
+        connection.read_cache.exit_block(committed)
+        if not connection.read_cache.frames:
+            connection.read_cache = None
+
+    if connection.atomic_trace is not None:
+        if not outermost:
+            if sid is not None:
+                connection.atomic_trace.event(
+                    'release' if committed else 'rollback')
+        else:
+            connection.atomic_trace.finish(committed)
+            connection.atomic_trace = None
+
+    if outermost:
+        if committed and connection.atomic_writes:
+            record_commit(connection.alias, connection.atomic_writes)
+        connection.atomic_writes = None
+        connection.atomic_entry_stack = None
+        # Row locks are released with the transaction.
+        connection.locked_rows = None
+
+
+def _patch_builtin_atomic():
+    """
+    Makes Django's own Atomic, returned by atomic() without extensions on
+    Django 1.6+, keep the state of the extensions as well. Otherwise, a
+    savepoint rolled back by a plain nested block would leave its writes in
+    the read cache.
+    """
+    try:
+        from django.db.transaction import Atomic as BuiltinAtomic
+    except ImportError:
+        return
+    enter, exit = BuiltinAtomic.__enter__, BuiltinAtomic.__exit__
+
+    def __enter__(self):
+        connection = get_connection(self.using)
+        outermost = not connection.in_atomic_block
+        enter(self)
+        _block_entered(connection, outermost)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection = get_connection(self.using)
+        sid = connection.savepoint_ids[-1] if connection.savepoint_ids \
+            else None
+        committed = (exc_type is None and not connection.needs_rollback and
+                     not connection.closed_in_transaction)
+        try:
+            return exit(self, exc_type, exc_value, traceback)
+        except Exception:
+            committed = False
+            raise
+        finally:
+            _block_exited(connection, committed, sid)
+
+    BuiltinAtomic.__enter__, BuiltinAtomic.__exit__ = __enter__, __exit__
+
+
+def atomic(using=None, savepoint=True, cache_reads=False, durable=False,
+           lock=None, lock_timeout=None, statement_timeout=None,
+           lock_wait_timeout=None):
     # Bare decorator: @atomic -- although the first argument is called
     # `using`, it's actually the function being decorated.
     if callable(using):
-        return Atomic(DEFAULT_DB_ALIAS, savepoint)(using)
+        return Atomic(DEFAULT_DB_ALIAS, savepoint, cache_reads, durable,
+                      lock, lock_timeout, statement_timeout,
+                      lock_wait_timeout)(using)
     # Decorator: @atomic(...) or context manager: with atomic(...): ...
     else:
-        return Atomic(using, savepoint)
+        return Atomic(using, savepoint, cache_reads, durable, lock,
+                      lock_timeout, statement_timeout, lock_wait_timeout)
 
 
 def _non_atomic_requests(view, using):
@@ -255,3 +463,6 @@ def non_atomic_requests(using=None):
         if using is None:
             using = DEFAULT_DB_ALIAS
         return lambda view: _non_atomic_requests(view, using)
+
+
+_patch_builtin_atomic()
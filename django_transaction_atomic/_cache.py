@@ -0,0 +1,112 @@
+# Transaction-scoped identity map for atomic(cache_reads=True).
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+
+from ._compat import ProxyDatabaseWrapper
+
+
+class ReadCache(object):
+    """
+    Identity map of model instances keyed by (model, pk).
+
+    A cache lives on the connection for as long as the atomic block that
+    created it. Every atomic block entered while the cache is active pushes a
+    frame that records the models written inside it. When a block is rolled
+    back, cached instances of those models are discarded, as they may reflect
+    writes that no longer exist.
+
+    The cache holds at most `max_size` instances, evicting the least recently
+    used one when full.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = getattr(settings, 'ATOMIC_READ_CACHE_SIZE', 1000)
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.frames = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, model, pk):
+        key = (model, pk)
+        try:
+            obj = self.entries.pop(key)
+        except KeyError:
+            return None
+        # Re-insert to mark as most recently used.
+        self.entries[key] = obj
+        return obj
+
+    def set(self, model, pk, obj):
+        key = (model, pk)
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+        self.entries[key] = obj
+
+    def invalidate(self, model):
+        for key in [key for key in self.entries if key[0] is model]:
+            del self.entries[key]
+
+    def written(self, model):
+        """
+        Invalidates a model after a save or delete, and records the write in
+        the innermost block.
+        """
+        self.invalidate(model)
+        if self.frames:
+            self.frames[-1].add(model)
+
+    def enter_block(self):
+        self.frames.append(set())
+
+    def exit_block(self, committed):
+        """
+        Pops the innermost frame. Writes are handed to the enclosing block on
+        success, and invalidated on rollback.
+        """
+        models = self.frames.pop()
+        if not committed:
+            for model in models:
+                self.invalidate(model)
+        if self.frames:
+            self.frames[-1].update(models)
+
+
+def cached_get(model, pk, using=None):
+    """
+    Gets a model instance by primary key, using the read cache of the current
+    atomic block if there is one.
+    """
+    if using is None:
+        using = DEFAULT_DB_ALIAS
+    pk = model._meta.pk.to_python(pk)
+    cache = ProxyDatabaseWrapper(connections[using]).read_cache
+    if cache is not None:
+        obj = cache.get(model, pk)
+        if obj is not None:
+            return obj
+
+    obj = model._default_manager.using(using).get(pk=pk)
+    if cache is not None:
+        cache.set(model, pk, obj)
+    return obj
+
+
+def _invalidate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    cache = getattr(connections[using], 'read_cache', None)
+    if cache is not None:
+        cache.written(sender)
+
+
+post_save.connect(
+    _invalidate, dispatch_uid='django_transaction_atomic._cache')
+post_delete.connect(
+    _invalidate, dispatch_uid='django_transaction_atomic._cache')
@@ -2,6 +2,7 @@
 # atomic implementation to work without changes.
 from __future__ import absolute_import
 
+import math
 import types
 
 try:
@@ -104,6 +105,13 @@ class ProxyDatabaseWrapper(object):
         setattrdefault(connection, 'closed_in_transaction', False)
         setattrdefault(connection, 'savepoint_ids', [])
         setattrdefault(connection, 'needs_rollback', False)
+        setattrdefault(connection, 'read_cache', None)
+        setattrdefault(connection, 'atomic_writes', None)
+        setattrdefault(connection, 'atomic_entry_stack', None)
+        setattrdefault(connection, 'locked_rows', None)
+        setattrdefault(connection, 'atomic_timeouts', None)
+        setattrdefault(connection, 'session_variables', None)
+        setattrdefault(connection, 'atomic_trace', None)
 
         # Proxy features as well.
         setattrdefault(connection, 'features',
@@ -120,8 +128,14 @@ class ProxyDatabaseWrapper(object):
             return object.__setattr__(self, name, value)
         return setattr(self._connection, name, value)
 
+    def _ensure_connection(self):
+        # Older versions lack ensure_connection(), opening a cursor connects.
+        if self._connection.connection is None:
+            self._connection.cursor().close()
+
     def get_autocommit(self):
         if isinstance(self._connection, SqliteDatabaseWrapper):
+            self._ensure_connection()
             return self._connection.connection.isolation_level in (None, '')
 
         elif isinstance(self._connection, MySQLDatabaseWrapper):
@@ -141,6 +155,7 @@ class ProxyDatabaseWrapper(object):
     def set_autocommit(self, autocommit,
                        force_begin_transaction_with_broken_autocommit=False):
         if isinstance(self._connection, SqliteDatabaseWrapper):
+            self._ensure_connection()
             self._connection.connection.isolation_level = \
                 None if autocommit else ''
 
@@ -165,3 +180,88 @@ class ProxyDatabaseWrapper(object):
             raise TransactionManagementError(
                 "The rollback flag doesn't work outside of an 'atomic' block.")
         self.needs_rollback = rollback
+
+    def _session_variables(self):
+        # Values known for the current database session. A new session (after
+        # the connection was closed) starts with an empty cache.
+        self._ensure_connection()
+        cached = self.session_variables
+        if cached is None or cached[0] is not self._connection.connection:
+            cached = (self._connection.connection, {})
+            self.session_variables = cached
+        return cached[1]
+
+    def get_session_variable(self, name):
+        values = self._session_variables()
+        if name not in values:
+            if isinstance(self._connection, SqliteDatabaseWrapper):
+                sql = 'PRAGMA %s' % name
+            elif isinstance(self._connection, MySQLDatabaseWrapper):
+                sql = 'SELECT @@SESSION.%s' % name
+            else:
+                raise NotImplementedError(
+                    'get_session_variable() not implemented for '
+                    'backend: %s' % self._connection.__class__)
+
+            C = self._connection.cursor()
+            try:
+                C.execute(sql)
+                values[name] = C.fetchone()[0]
+
+            finally:
+                C.close()
+
+        return values[name]
+
+    def set_session_variable(self, name, value):
+        values = self._session_variables()
+        if values.get(name) == value:
+            # Don't send redundant SET statements.
+            return
+
+        if isinstance(self._connection, SqliteDatabaseWrapper):
+            sql = 'PRAGMA %s = %d' % (name, value)
+        elif isinstance(self._connection, MySQLDatabaseWrapper):
+            sql = 'SET SESSION %s = %d' % (name, value)
+        else:
+            raise NotImplementedError(
+                'set_session_variable() not implemented for '
+                'backend: %s' % self._connection.__class__)
+
+        C = self._connection.cursor()
+        try:
+            C.execute(sql)
+
+        finally:
+            C.close()
+
+        values[name] = value
+
+    def get_timeout_variables(self, statement_timeout=None,
+                              lock_wait_timeout=None):
+        """
+        Returns the session variables, as (name, value) tuples, implementing
+        timeouts given in seconds. SQLite has no statement timeout.
+        """
+        variables = []
+        if isinstance(self._connection, SqliteDatabaseWrapper):
+            if lock_wait_timeout is not None:
+                variables.append(
+                    ('busy_timeout', int(lock_wait_timeout * 1000)))
+
+        elif isinstance(self._connection, MySQLDatabaseWrapper):
+            if statement_timeout is not None:
+                variables.append(
+                    ('max_execution_time', int(statement_timeout * 1000)))
+            if lock_wait_timeout is not None:
+                # Whole seconds only, at least one.
+                variables.append(
+                    ('innodb_lock_wait_timeout',
+                     max(1, int(math.ceil(lock_wait_timeout)))))
+
+        else:
+            raise NotImplementedError(
+                'get_timeout_variables() not implemented for '
+                'backend: %s' % self._connection.__class__)
+
+        return variables
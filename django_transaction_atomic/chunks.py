@@ -0,0 +1,152 @@
+# Bulk processing in chunks, each chunk in its own transaction.
+from __future__ import absolute_import
+
+import sys
+import threading
+import time
+from itertools import islice
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from django.db import connections, DatabaseError
+
+from ._atomic import Atomic, TransactionManagementError, get_connection
+
+
+# MySQL ER_LOCK_WAIT_TIMEOUT and ER_LOCK_DEADLOCK.
+DEADLOCK_ERRORS = (1205, 1213)
+
+
+def is_deadlock(e):
+    """
+    Returns True if a DatabaseError is worth retrying: a deadlock, a lock
+    wait timeout or a locked SQLite database.
+    """
+    if e.args and e.args[0] in DEADLOCK_ERRORS:
+        return True
+    message = str(e).lower()
+    return 'deadlock' in message or 'database is locked' in message
+
+
+def _chunked(iterable, size, start=0):
+    iterator = islice(iterable, start, None)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _prefetched(chunks):
+    """
+    Pulls chunks in a background thread, one chunk ahead of the consumer.
+    """
+    queue = Queue(maxsize=1)
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for chunk in chunks:
+                queue.put((chunk, None))
+                if stop.is_set():
+                    return
+            queue.put((None, None))
+        except Exception:
+            queue.put((None, sys.exc_info()[1]))
+        finally:
+            # Database connections are thread local, don't leak this one.
+            for connection in connections.all():
+                connection.close()
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            chunk, e = queue.get()
+            if e is not None:
+                raise e
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Unblock the worker if it is waiting to hand over a chunk.
+        stop.set()
+        try:
+            queue.get_nowait()
+        except Empty:
+            pass
+
+
+def _chunks(iterable, size, using, prefetch, start):
+    if get_connection(using).in_atomic_block:
+        raise TransactionManagementError(
+            "Chunks can't be committed inside an 'atomic' block.")
+    chunks = _chunked(iterable, size, start)
+    if prefetch:
+        chunks = _prefetched(chunks)
+    return chunks
+
+
+def atomic_chunks(iterable, size=100, using=None, prefetch=False, start=0,
+                  checkpoint=None):
+    """
+    Yields lists of up to `size` items from `iterable`, each inside its own
+    outermost atomic block. The block commits when the next chunk is
+    requested, and rolls back if the loop is left with an exception.
+
+    Leaving the loop with `break` leaves the block of the current chunk open
+    until the generator is closed, and later queries run in its transaction.
+    Wrap the generator in contextlib.closing() to close it when the loop is
+    left, or use process_chunks(). Closing rolls the chunk back, since
+    GeneratorExit can't be told apart from an error: to stop early, bound
+    `iterable` instead (with itertools.islice(), say).
+
+    With `prefetch=True`, the next chunk is read in a background thread while
+    the current one is processed.
+
+    To resume an interrupted job, pass the number of items already committed
+    as `start`. Those items are still read from `iterable`, then discarded:
+    for a queryset, filter out the rows already processed instead (by pk,
+    say) so that they are not fetched again. `checkpoint`, if given, is
+    called with the number of items committed after each commit.
+    """
+    done = start
+    for chunk in _chunks(iterable, size, using, prefetch, start):
+        with Atomic(using, savepoint=True):
+            yield chunk
+        done += len(chunk)
+        if checkpoint is not None:
+            checkpoint(done)
+
+
+def process_chunks(func, iterable, size=100, using=None, prefetch=False,
+                   start=0, checkpoint=None, retries=3):
+    """
+    Like atomic_chunks(), but calls `func(chunk)` for each chunk. A chunk
+    rolled back by a deadlock is retried up to `retries` times.
+
+    Returns the number of items committed, including `start`.
+    """
+    done = start
+    for chunk in _chunks(iterable, size, using, prefetch, start):
+        attempt = 0
+        while True:
+            try:
+                with Atomic(using, savepoint=True):
+                    func(chunk)
+            except DatabaseError as e:
+                if attempt >= retries or not is_deadlock(e):
+                    raise
+                attempt += 1
+                time.sleep(0.05 * attempt)
+                continue
+            break
+        done += len(chunk)
+        if checkpoint is not None:
+            checkpoint(done)
+    return done
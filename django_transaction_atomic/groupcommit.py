@@ -0,0 +1,137 @@
+# Group commit: many small transactions from many threads, one COMMIT.
+from __future__ import absolute_import
+
+import threading
+import time
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+try:
+    from concurrent.futures import Future
+except ImportError:
+    # Python 2 requires the futures backport.
+    Future = None
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from ._atomic import Atomic, TransactionManagementError, get_connection
+
+
+class GroupCommitExecutor(object):
+    """
+    Runs callables submitted from any thread as savepoints of one shared
+    transaction, on a dedicated thread and connection.
+
+    The transaction commits when `max_batch` callables ran, or `max_latency`
+    seconds after the first one was submitted. submit() returns a future that
+    resolves after that commit. A callable that raises only rolls back its
+    own savepoint, and only its future fails.
+    """
+
+    def __init__(self, using=None, max_batch=100, max_latency=0.01):
+        if Future is None:
+            raise ImproperlyConfigured(
+                'GroupCommitExecutor requires concurrent.futures, install '
+                'the futures package.')
+        self.using = using
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue = Queue()
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, func, *args, **kwargs):
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit after shutdown')
+            future = Future()
+            self._queue.put((future, func, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Commits the pending callables and stops the executor.
+        """
+        with self._shutdown_lock:
+            if not self._shutdown:
+                self._shutdown = True
+                self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+    def _next_batch(self):
+        """
+        Returns the next batch and whether the executor was shut down.
+        """
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run_batch(self, batch):
+        done = []
+        try:
+            with Atomic(self.using, savepoint=True):
+                for future, func, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with Atomic(self.using, savepoint=True):
+                            result = func(*args, **kwargs)
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        done.append((future, result))
+
+                if get_connection(self.using).needs_rollback:
+                    # A callable broke the transaction without a savepoint to
+                    # roll back to, everything is rolled back.
+                    raise TransactionManagementError(
+                        'The group commit was rolled back.')
+        except Exception as e:
+            # Nothing was committed: fail every future not resolved yet,
+            # including those never run when the transaction didn't begin.
+            for future, func, args, kwargs in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, result in done:
+                future.set_result(result)
+
+    def _run(self):
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._run_batch(batch)
+        finally:
+            # This thread's connection is dedicated to the executor.
+            for connection in connections.all():
+                connection.close()
@@ -0,0 +1,257 @@
+# Named advisory locks for atomic(lock=...).
+from __future__ import absolute_import
+
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections
+)
+from django.dispatch import Signal
+
+from ._compat import (
+    Error, MySQLDatabaseWrapper, ProxyDatabaseWrapper, SqliteDatabaseWrapper,
+    TransactionManagementError
+)
+
+
+# Sent after every attempt to acquire a lock, with the arguments `name`,
+# `using`, `wait` (in seconds) and `acquired`.
+lock_waited = Signal()
+
+# Table holding the locks on SQLite. Rows are committed outside of the
+# transaction so that other connections see them.
+LOCK_TABLE = 'django_transaction_atomic_lock'
+
+# Interval between attempts to acquire a lock on SQLite, in seconds.
+POLL_INTERVAL = 0.05
+
+# Age after which a lock row on SQLite is considered left behind by a crashed
+# process and is deleted, in seconds. None never expires locks: the age of a
+# row can't tell a crashed holder from a long transaction.
+DEFAULT_LOCK_EXPIRY = None
+
+_stats_lock = threading.Lock()
+_stats = {
+    'acquired': 0,
+    'timeouts': 0,
+    'wait': 0.0,
+    'max_wait': 0.0,
+}
+
+
+class LockTimeoutError(DatabaseError):
+    """
+    This exception is thrown when a lock isn't acquired within its timeout.
+    """
+    pass
+
+
+def get_lock_stats():
+    """
+    Returns the number of locks acquired and timed out in this process, and
+    the total and maximum time spent waiting for them.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_lock_stats():
+    with _stats_lock:
+        _stats.update(acquired=0, timeouts=0, wait=0.0, max_wait=0.0)
+
+
+def _record(connection, name, wait, acquired):
+    with _stats_lock:
+        _stats['acquired' if acquired else 'timeouts'] += 1
+        _stats['wait'] += wait
+        _stats['max_wait'] = max(_stats['max_wait'], wait)
+    lock_waited.send(sender=connection._connection.__class__, name=name,
+                     using=connection.alias, wait=wait, acquired=acquired)
+
+
+def _execute(connection, sql, params=None):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        try:
+            return cursor.fetchone()
+        except Error:
+            return None
+    finally:
+        cursor.close()
+
+
+def _is_backend(connection, wrapper):
+    return wrapper is not None and isinstance(connection._connection, wrapper)
+
+
+def _sqlite_end(connection, commit=True):
+    # Outside of a transaction, end the implicit transaction the statement may
+    # have begun, so that other connections see the row right away.
+    if not connection.in_atomic_block:
+        if commit:
+            connection.connection.commit()
+        else:
+            connection.connection.rollback()
+
+
+def _mysql_acquire(connection, name, timeout):
+    if timeout is None:
+        timeout = -1
+    row = _execute(connection, 'SELECT GET_LOCK(%s, %s)', [name, timeout])
+    return row[0] == 1
+
+
+def _sqlite_acquire(connection, name, timeout):
+    _execute(connection, 'CREATE TABLE IF NOT EXISTS %s '
+             '(name varchar(255) PRIMARY KEY, acquired real)' % LOCK_TABLE)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            _execute(connection, 'INSERT INTO %s (name, acquired) '
+                     'VALUES (%%s, %%s)' % LOCK_TABLE, [name, time.time()])
+        except IntegrityError:
+            _sqlite_end(connection, commit=False)
+            if _sqlite_expire(connection, name):
+                continue
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        else:
+            _sqlite_end(connection)
+            return True
+
+
+def _sqlite_expire(connection, name):
+    expiry = getattr(settings, 'ATOMIC_LOCK_EXPIRY', DEFAULT_LOCK_EXPIRY)
+    if expiry is None:
+        return False
+    cursor = connection.cursor()
+    try:
+        cursor.execute('DELETE FROM %s WHERE name = %%s AND acquired < %%s' %
+                       LOCK_TABLE, [name, time.time() - expiry])
+        expired = cursor.rowcount > 0
+    finally:
+        cursor.close()
+    _sqlite_end(connection)
+    return expired
+
+
+def _sqlite_release(connection, name):
+    # The row was committed outside of the transaction, any connection can
+    # delete it. Used when the connection was closed in the block.
+    if hasattr(connection, 'get_new_connection'):
+        raw = connection.get_new_connection(
+            connection.get_connection_params())
+    else:
+        raw = sqlite3.connect(connection.settings_dict['NAME'])
+    try:
+        raw.execute('DELETE FROM %s WHERE name = ?' % LOCK_TABLE, [name])
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def acquire_lock(connection, name, timeout=None):
+    """
+    Acquires the named lock, waiting at most `timeout` seconds (forever if
+    None). Raises LockTimeoutError if the lock wasn't acquired.
+
+    MySQL uses GET_LOCK(), SQLite a lock table whose rows expire after
+    ATOMIC_LOCK_EXPIRY seconds, if that setting is not None.
+    """
+    start = time.time()
+    if _is_backend(connection, MySQLDatabaseWrapper):
+        acquired = _mysql_acquire(connection, name, timeout)
+    elif _is_backend(connection, SqliteDatabaseWrapper):
+        acquired = _sqlite_acquire(connection, name, timeout)
+    else:
+        raise NotImplementedError(
+            'acquire_lock() not implemented for backend: %s' %
+            connection._connection.__class__)
+    _record(connection, name, time.time() - start, acquired)
+    if not acquired:
+        raise LockTimeoutError(
+            "Lock '%s' not acquired within %s seconds." % (name, timeout))
+
+
+def release_lock(connection, name):
+    """
+    Releases the named lock. This never raises, as it is called while an
+    exception may be propagating.
+    """
+    if (connection.connection is None and
+            _is_backend(connection, MySQLDatabaseWrapper)):
+        # MySQL released the locks when the connection was closed.
+        return
+
+    if _is_backend(connection, MySQLDatabaseWrapper):
+        try:
+            _execute(connection, 'SELECT RELEASE_LOCK(%s)', [name])
+        except Error:
+            # Closing the connection releases MySQL locks as well.
+            connection.close()
+        return
+
+    try:
+        _execute(connection, 'DELETE FROM %s WHERE name = %%s' % LOCK_TABLE,
+                 [name])
+        _sqlite_end(connection)
+    except Error:
+        # Closing the connection doesn't release SQLite locks, delete the row
+        # from a new connection. Rows that can't be deleted expire, if
+        # ATOMIC_LOCK_EXPIRY is set.
+        try:
+            _sqlite_release(connection, name)
+        except (Error, sqlite3.Error):
+            pass
+
+
+def _model_label(model):
+    # Proxy models share the rows, and so the lock order, of their concrete
+    # model.
+    model = model._meta.concrete_model
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+
+def lock_rows(rows, using=None):
+    """
+    Locks rows, given as (model, pk) pairs, with SELECT ... FOR UPDATE.
+
+    Rows are always locked in the same order, by model label then pk, with
+    one statement per model. That way, two transactions locking overlapping
+    rows never wait for each other in a cycle. Rows already locked by the
+    current transaction are skipped.
+
+    Returns the number of rows locked.
+    """
+    if using is None:
+        using = DEFAULT_DB_ALIAS
+    connection = ProxyDatabaseWrapper(connections[using])
+    if not connection.in_atomic_block:
+        raise TransactionManagementError(
+            "Rows can only be locked inside an 'atomic' block.")
+    # Tracked by every outermost block, see _atomic._block_entered().
+    locked_rows = connection.locked_rows or ()
+
+    by_label = {}
+    for model, pk in rows:
+        model = model._meta.concrete_model
+        label = _model_label(model)
+        pk = model._meta.pk.to_python(pk)
+        if (label, pk) not in locked_rows:
+            by_label.setdefault(label, (model, set()))[1].add(pk)
+
+    count = 0
+    for label in sorted(by_label):
+        model, pks = by_label[label]
+        locked = model._default_manager.using(using).select_for_update() \
+            .filter(pk__in=pks).order_by('pk').values_list('pk', flat=True)
+        for pk in locked:
+            if connection.locked_rows is not None:
+                connection.locked_rows.add((label, pk))
+            count += 1
+    return count
@@ -0,0 +1,51 @@
+from __future__ import absolute_import
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from ...outbox import run_relay
+
+
+# Names of the types for optparse.
+OPTPARSE_TYPES = {str: 'string', int: 'int', float: 'float'}
+
+# (flag, type, default, help), shared by optparse and argparse.
+OPTIONS = (
+    ('--database', str, DEFAULT_DB_ALIAS, 'Database holding the outbox.'),
+    ('--batch-size', int, 100, 'Messages delivered per batch.'),
+    ('--workers', int, 4, 'Messages delivered in parallel.'),
+    ('--max-attempts', int, 10, 'Attempts before a message is given up.'),
+    ('--retry-delay', float, 1.0,
+     'Seconds before a failed message is retried, doubled at each attempt.'),
+    ('--interval', float, 1.0, 'Seconds to sleep when the outbox is empty.'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Delivers the messages written to the outbox by enqueue().'
+
+    if not hasattr(BaseCommand, 'add_arguments'):
+        option_list = BaseCommand.option_list + tuple(
+            make_option(flag, type=OPTPARSE_TYPES[kind], default=default,
+                        help=text)
+            for flag, kind, default, text in OPTIONS
+        ) + (
+            make_option('--once', action='store_true', default=False,
+                        help='Stop when the outbox is empty.'),
+        )
+
+    def add_arguments(self, parser):
+        for flag, kind, default, text in OPTIONS:
+            parser.add_argument(flag, type=kind, default=default, help=text)
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Stop when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        run_relay(interval=options['interval'], once=options['once'],
+                  batch_size=options['batch_size'],
+                  workers=options['workers'],
+                  max_attempts=options['max_attempts'],
+                  retry_delay=options['retry_delay'],
+                  using=options['database'])
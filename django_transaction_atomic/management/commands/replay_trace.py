@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...replay import replay
+from .outbox_relay import OPTPARSE_TYPES
+
+
+# (flag, type, default, help), shared by optparse and argparse.
+OPTIONS = (
+    ('--database', str, None,
+     'Database to replay against, instead of the recorded one.'),
+    ('--concurrency', int, 4, 'Transactions replayed in parallel.'),
+    ('--speedup', float, 1.0, 'Factor dividing the recorded timings.'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Replays a transaction trace and reports throughput and latency.'
+    args = '<path>'
+
+    if not hasattr(BaseCommand, 'add_arguments'):
+        option_list = BaseCommand.option_list + tuple(
+            make_option(flag, type=OPTPARSE_TYPES[kind], default=default,
+                        help=text)
+            for flag, kind, default, text in OPTIONS
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Trace file to replay.')
+        for flag, kind, default, text in OPTIONS:
+            parser.add_argument(flag, type=kind, default=default, help=text)
+
+    def handle(self, *args, **options):
+        path = options.get('path') or (args[0] if args else None)
+        if path is None:
+            raise CommandError('Enter the path of a trace file.')
+
+        stats = replay(path, using=options['database'],
+                       concurrency=options['concurrency'],
+                       speedup=options['speedup'])
+
+        self.stdout.write('Transactions: %d\n' % stats['transactions'])
+        self.stdout.write('Errors: %d\n' % stats['errors'])
+        if stats['throughput'] is not None:
+            self.stdout.write('Throughput: %.1f/s\n' % stats['throughput'])
+        for percentile in ('p50', 'p90', 'p99'):
+            if stats[percentile] is not None:
+                self.stdout.write('Latency %s: %.1fms\n' % (
+                    percentile, stats[percentile] * 1000))
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('delivered', models.DateTimeField(db_index=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -1,5 +1,14 @@
 from django.db import models
 
 
-class Model1(models.Model):
-    name = models.CharField(max_length=120)
+class OutboxMessage(models.Model):
+    """
+    A message written by enqueue() and delivered by the outbox relay.
+    """
+    destination = models.CharField(max_length=255)
+    payload = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    delivered = models.DateTimeField(null=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # Failed messages are not retried before this time.
+    next_attempt = models.DateTimeField(null=True)
@@ -0,0 +1,182 @@
+# Transactional outbox: messages are written in the transaction and delivered
+# by a relay once it committed.
+from __future__ import absolute_import
+
+import datetime
+import json
+import logging
+import threading
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of the delay between two attempts of a message, in seconds.
+MAX_RETRY_DELAY = 3600
+
+_handlers = {}
+
+
+def register_handler(destination, handler=None):
+    """
+    Registers the callable delivering the payloads sent to `destination`.
+    Can be used as a decorator.
+    """
+    if handler is None:
+        return lambda handler: register_handler(destination, handler)
+    _handlers[destination] = handler
+    return handler
+
+
+def enqueue(destination, payload, using=None):
+    """
+    Writes a message to the outbox. Inside an atomic block, the message is
+    only delivered if the transaction commits.
+
+    `payload` must be serializable to JSON.
+    """
+    if using is None:
+        using = DEFAULT_DB_ALIAS
+    return OutboxMessage.objects.using(using).create(
+        destination=destination,
+        payload=json.dumps(payload, cls=DjangoJSONEncoder))
+
+
+def _deliver(message):
+    try:
+        handler = _handlers[message.destination]
+        handler(json.loads(message.payload))
+    except Exception:
+        logger.exception('Could not deliver outbox message %s to %s',
+                         message.pk, message.destination)
+        return False
+    return True
+
+
+class DeliveryPool(object):
+    """
+    Threads delivering messages in parallel. Handlers may use the database,
+    each thread closes its connections when the pool is closed.
+    """
+
+    def __init__(self, workers=4):
+        self._tasks = Queue()
+        self._threads = [threading.Thread(target=self._run)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def deliver(self, messages):
+        """
+        Delivers messages, returning whether each one was delivered.
+        """
+        results = Queue()
+        for index, message in enumerate(messages):
+            self._tasks.put((index, message, results))
+        delivered = [False] * len(messages)
+        for message in messages:
+            index, ok = results.get()
+            delivered[index] = ok
+        return delivered
+
+    def close(self):
+        """
+        Stops the threads and waits for them.
+        """
+        for thread in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    return
+                index, message, results = task
+                results.put((index, _deliver(message)))
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+
+def relay(batch_size=100, workers=4, max_attempts=10, retry_delay=1.0,
+          using=None, pool=None):
+    """
+    Delivers a batch of pending messages in parallel, then marks them in
+    bulk. Failed messages are retried by later calls, up to `max_attempts`
+    times, after a delay of `retry_delay` seconds doubled at each attempt
+    (at most MAX_RETRY_DELAY).
+
+    Messages are delivered by `pool`, a DeliveryPool, or by a pool of
+    `workers` threads for this batch only.
+
+    Returns the number of messages in the batch.
+    """
+    if using is None:
+        using = DEFAULT_DB_ALIAS
+    now = timezone.now()
+    messages = list(
+        OutboxMessage.objects.using(using)
+        .filter(delivered__isnull=True, attempts__lt=max_attempts)
+        .filter(Q(next_attempt__isnull=True) | Q(next_attempt__lte=now))
+        .order_by('pk')[:batch_size])
+    if not messages:
+        return 0
+
+    if pool is not None:
+        results = pool.deliver(messages)
+    else:
+        pool = DeliveryPool(min(workers, len(messages)))
+        try:
+            results = pool.deliver(messages)
+        finally:
+            pool.close()
+
+    queryset = OutboxMessage.objects.using(using)
+    delivered = [m.pk for m, ok in zip(messages, results) if ok]
+    if delivered:
+        queryset.filter(pk__in=delivered).update(
+            delivered=timezone.now(), attempts=F('attempts') + 1)
+
+    # Messages that failed as often share their delay.
+    failed = {}
+    for message, ok in zip(messages, results):
+        if not ok:
+            failed.setdefault(message.attempts, []).append(message.pk)
+    for attempts, pks in failed.items():
+        delay = min(retry_delay * 2 ** attempts, MAX_RETRY_DELAY)
+        queryset.filter(pk__in=pks).update(
+            attempts=F('attempts') + 1,
+            next_attempt=now + datetime.timedelta(seconds=delay))
+    return len(messages)
+
+
+def run_relay(interval=1.0, once=False, workers=4, **kwargs):
+    """
+    Relays messages until interrupted, sleeping `interval` seconds whenever
+    no message is due. With `once`, stops when no message is due.
+    """
+    pool = DeliveryPool(workers)
+    try:
+        while True:
+            if not relay(pool=pool, **kwargs):
+                if once:
+                    return
+                time.sleep(interval)
+    finally:
+        pool.close()
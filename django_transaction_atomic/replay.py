@@ -0,0 +1,248 @@
+# Replays transaction traces written by the trace recorder.
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import json
+import random
+import re
+import string
+import threading
+import time
+import uuid
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from ._atomic import Atomic, get_connection
+
+
+class _Rollback(Exception):
+    pass
+
+
+# Shapes of dates and times, which must stay valid when synthesized.
+DATETIME_SHAPE = re.compile(r'^(9999-99-99)?([ A])?(99:99(?::99)?)?(\.9+)?'
+                            r'([+-]99:99)?$')
+
+# Synthetic dates and times are taken from 2000 to 2019.
+_EPOCH = datetime.datetime(2000, 1, 1)
+_SECONDS = 20 * 365 * 24 * 3600
+
+
+def _fill(shape, rng):
+    chars = {'9': string.digits, 'a': string.ascii_lowercase,
+             'A': string.ascii_uppercase}
+    return u''.join(rng.choice(chars[c]) if c in chars else c for c in shape)
+
+
+def _fill_number(shape, rng):
+    text = _fill(shape, rng)
+    sign, digits = ('-', text[1:]) if text.startswith('-') else ('', text)
+    # Keep the number of digits: no leading zero.
+    if digits[:1] == '0' and len(digits.split('.')[0]) > 1:
+        digits = rng.choice(string.digits[1:]) + digits[1:]
+    return sign + digits
+
+
+def _datetime(rng):
+    return _EPOCH + datetime.timedelta(seconds=rng.randrange(_SECONDS),
+                                       microseconds=rng.randrange(10 ** 6))
+
+
+def _synthesize_str(shape, rng):
+    match = DATETIME_SHAPE.match(shape)
+    if match is None:
+        return _fill(shape, rng)
+    date, separator, time_, fraction, offset = match.groups()
+    if (not (date or time_) or (separator and not (date and time_)) or
+            ((fraction or offset) and not time_)):
+        return _fill(shape, rng)
+
+    value = _datetime(rng)
+    text = value.strftime('%Y-%m-%d') if date else ''
+    if separator:
+        text += ' ' if separator == ' ' else 'T'
+    if time_:
+        text += value.strftime('%H:%M:%S')[:len(time_)]
+    if fraction:
+        text += '.' + ('%06d' % value.microsecond).ljust(
+            len(fraction) - 1, '0')[:len(fraction) - 1]
+    if offset:
+        text += offset[0] + '00:00'
+    return text
+
+
+def synthesize(param):
+    """
+    Returns a synthetic value for a parameter redacted by trace.Redactor, of
+    the same type and shape. Equal tokens give equal values. Parameters that
+    weren't redacted are returned as they are.
+    """
+    if not isinstance(param, dict) or 'type' not in param:
+        return param
+    kind = param['type']
+    if kind == 'list':
+        return [synthesize(item) for item in param['items']]
+    if 'value' in param:
+        # Infinities and NaNs are kept.
+        return (decimal.Decimal if kind == 'decimal' else float)(
+            param['value'])
+
+    rng = random.Random(int(param['token'], 16))
+    if kind == 'bool':
+        return rng.random() < 0.5
+    if kind == 'int':
+        return int(_fill_number(param['shape'], rng))
+    if kind == 'decimal':
+        return decimal.Decimal(_fill_number(param['shape'], rng))
+    if kind == 'float':
+        return float(_fill_number(param['shape'], rng))
+    if kind == 'bytes':
+        return bytes(bytearray(rng.randrange(256)
+                               for i in range(param['length'])))
+    if kind == 'datetime':
+        value = _datetime(rng)
+        return timezone.make_aware(value, timezone.utc) if param['aware'] \
+            else value
+    if kind == 'date':
+        return _datetime(rng).date()
+    if kind == 'time':
+        return _datetime(rng).time()
+    if kind == 'uuid':
+        return uuid.UUID(int=rng.getrandbits(128))
+    return _synthesize_str(param['shape'], rng)
+
+
+def _synthesize_params(params):
+    if isinstance(params, dict):
+        return dict((name, synthesize(param))
+                    for name, param in params.items())
+    if params is not None:
+        return [synthesize(param) for param in params]
+    return params
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def replay_transaction(record, using=None, speedup=1.0):
+    """
+    Re-runs a recorded transaction, including its savepoints, statements and
+    outcome, with synthetic values for the redacted parameters. The time
+    between events is divided by `speedup`.
+
+    Returns True if no statement failed.
+    """
+    if using is None:
+        using = record['using']
+    blocks = [Atomic(using, savepoint=True)]
+    blocks[0].__enter__()
+    start = time.time()
+    ok = True
+    try:
+        for event in record['events']:
+            delay = event[1] / speedup - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+            if event[0] == 'savepoint':
+                blocks.append(Atomic(using, savepoint=True))
+                blocks[-1].__enter__()
+            elif event[0] == 'release':
+                blocks.pop().__exit__(None, None, None)
+            elif event[0] == 'rollback':
+                blocks.pop().__exit__(_Rollback, _Rollback(), None)
+            else:
+                cursor = get_connection(using).cursor()
+                try:
+                    cursor.execute(event[2], _synthesize_params(event[3]))
+                finally:
+                    cursor.close()
+    except DatabaseError:
+        ok = False
+    finally:
+        # Unwind whatever is left, rolling back on errors.
+        failed = not ok or record['outcome'] != 'commit'
+        while blocks:
+            if failed:
+                blocks.pop().__exit__(_Rollback, _Rollback(), None)
+            else:
+                blocks.pop().__exit__(None, None, None)
+    return ok
+
+
+def replay(path, using=None, concurrency=4, speedup=1.0):
+    """
+    Replays a trace file against a database, starting each transaction at
+    its recorded time (divided by `speedup`) on one of `concurrency` threads.
+
+    Returns the number of transactions and errors, the throughput in
+    transactions per second and the latency percentiles in seconds.
+    """
+    queue = Queue(maxsize=concurrency * 2)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                record = queue.get()
+                if record is None:
+                    return
+                start = time.time()
+                try:
+                    ok = replay_transaction(record, using=using,
+                                            speedup=speedup)
+                except Exception:
+                    ok = False
+                latency = time.time() - start
+                with lock:
+                    latencies.append(latency)
+                    if not ok:
+                        errors[0] += 1
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    first = None
+    with open(path) as trace:
+        for line in trace:
+            record = json.loads(line)
+            if first is None:
+                first = record['start']
+            delay = (record['start'] - first) / speedup - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+            queue.put(record)
+
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return {
+        'transactions': len(latencies),
+        'errors': errors[0],
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'p50': _percentile(latencies, 50),
+        'p90': _percentile(latencies, 90),
+        'p99': _percentile(latencies, 99),
+    }
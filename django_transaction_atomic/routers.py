@@ -0,0 +1,123 @@
+# Database router pinning reads to the primary after an atomic block commits.
+from __future__ import absolute_import
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+
+
+_local = threading.local()
+
+
+def get_primary():
+    return getattr(settings, 'ATOMIC_PRIMARY_DATABASE', DEFAULT_DB_ALIAS)
+
+
+def get_pins():
+    """
+    Returns the pinned models of this thread, mapped to the time their pin
+    expires, or None if it lasts until the end of the request.
+    """
+    try:
+        return _local.pins
+    except AttributeError:
+        _local.pins = {}
+        return _local.pins
+
+
+def clear_pins(**kwargs):
+    """
+    Unpins all models. Called when a request finishes.
+    """
+    _local.pins = {}
+
+
+def record_commit(using, models):
+    """
+    Pins models to the primary after a transaction writing to them committed
+    on `using`. Commits on other databases are ignored.
+
+    The pin lasts `ATOMIC_PIN_SECONDS`, or until the end of the request if
+    that setting is None (the default).
+    """
+    if using != get_primary():
+        return
+    seconds = getattr(settings, 'ATOMIC_PIN_SECONDS', None)
+    expires = None if seconds is None else time.time() + seconds
+    pins = get_pins()
+    for model in models:
+        pins[model] = expires
+
+
+def is_pinned(model):
+    pins = get_pins()
+    try:
+        expires = pins[model]
+    except KeyError:
+        return False
+    if expires is not None and expires <= time.time():
+        del pins[model]
+        return False
+    return True
+
+
+class StickyPrimaryRouter(object):
+    """
+    Routes reads to `ATOMIC_REPLICA_DATABASES` and writes to
+    `ATOMIC_PRIMARY_DATABASE`.
+
+    Models written on the primary are read from the primary for a while after
+    the write committed, so that they don't miss their own writes on a
+    lagging replica. Inside an atomic block on the primary, all reads go to
+    the primary.
+
+    Writes are seen through the post_save and post_delete signals, which
+    QuerySet.update(), bulk_create() and raw SQL don't send: call
+    record_commit() after those.
+    """
+
+    def __init__(self):
+        # Django creates its routers from DATABASE_ROUTERS: writes are only
+        # tracked in projects that install this one.
+        _connect_receivers()
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'ATOMIC_REPLICA_DATABASES', ())
+        primary = get_primary()
+        if (not replicas or is_pinned(model) or
+                getattr(connections[primary], 'in_atomic_block', False)):
+            return primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return get_primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def _record_write(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    connection = connections[using]
+    # Set to a set() for the life of an outermost block, by Atomic and by
+    # Django's own Atomic. Pinned once when the block commits.
+    writes = getattr(connection, 'atomic_writes', None)
+    if writes is not None:
+        writes.add(sender)
+    else:
+        # Autocommit, or a transaction we can't follow: pinning early only
+        # costs a few reads on the primary.
+        record_commit(using, [sender])
+
+
+def _connect_receivers():
+    post_save.connect(
+        _record_write, dispatch_uid='django_transaction_atomic.routers')
+    post_delete.connect(
+        _record_write, dispatch_uid='django_transaction_atomic.routers')
+    request_finished.connect(
+        clear_pins, dispatch_uid='django_transaction_atomic.routers')
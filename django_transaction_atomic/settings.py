@@ -31,6 +31,7 @@ ALLOWED_HOSTS = []
 
 INSTALLED_APPS = (
     'django_transaction_atomic',
+    'django_transaction_atomic.testapp',
 )
 
 MIDDLEWARE_CLASSES = (
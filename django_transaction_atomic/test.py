@@ -1,16 +1,40 @@
 
 from __future__ import absolute_import
 
+import copy
+import json
+import os
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.python import (
+    Deserializer as PythonDeserializer, _get_model
+)
 from django.core.management import call_command
-from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.management.color import no_style
+from django.db import connections, router, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, pre_save
 from django.test import TestCase
 
+try:
+    from django.apps import apps
+
+    def _app_paths():
+        return [app_config.path for app_config in apps.get_app_configs()]
+
+except ImportError:
+    from django.db.models import get_apps
+
+    def _app_paths():
+        return [os.path.dirname(app.__file__) for app in get_apps()]
+
 try:
     from django.db.transaction import atomic as _atomic
 except ImportError:
     _atomic = None
 
-from ._atomic import atomic, set_rollback
+from ._atomic import Atomic, atomic, set_rollback
 
 
 def connections_support_transactions():
@@ -21,6 +45,204 @@ def connections_support_transactions():
                for conn in connections.all())
 
 
+# Parsed fixtures, keyed by (fixture label, database alias). Each value is a
+# tuple of ({path: mtime}, [DeserializedObject, ...]).
+_fixture_cache = {}
+
+
+def _allow_load(using, model):
+    try:
+        return router.allow_migrate_model(using, model)
+    except AttributeError:
+        return router.allow_syncdb(using, model)
+
+
+def find_fixture_files(label, using=DEFAULT_DB_ALIAS):
+    """
+    Returns a list of (path, format) tuples for the files matching a fixture
+    label, or None if the label uses a feature (such as compression or
+    database specific files) that only loaddata understands.
+    """
+    formats = [fmt for fmt in serializers.get_public_serializer_formats()
+               if fmt in _LOADERS]
+    name, ext = os.path.splitext(label)
+    if ext[1:] in formats:
+        formats = [ext[1:]]
+    elif ext:
+        return None
+
+    if os.path.isabs(name):
+        dirs = [os.path.dirname(name)]
+        name = os.path.basename(name)
+    else:
+        dirs = [os.path.join(path, 'fixtures') for path in _app_paths()]
+        dirs.extend(getattr(settings, 'FIXTURE_DIRS', ()))
+        dirs.append('')
+
+    found = []
+    for fixture_dir in dirs:
+        for fmt in formats:
+            path = os.path.join(fixture_dir, '%s.%s.%s' % (name, using, fmt))
+            if os.path.isfile(path):
+                # loaddata loads name.<database>.<format> files as well.
+                return None
+            path = os.path.join(fixture_dir, '%s.%s' % (name, fmt))
+            if os.path.isfile(path):
+                found.append((os.path.abspath(path), fmt))
+    return found or None
+
+
+def _load_yaml(fixture):
+    import yaml
+    try:
+        from django.core.serializers.pyyaml import DjangoSafeLoader
+    except ImportError:
+        DjangoSafeLoader = yaml.SafeLoader
+    return yaml.load(fixture, Loader=DjangoSafeLoader)
+
+
+# Parsers for the formats that can be cached, returning Python primitives.
+_LOADERS = {
+    'json': json.load,
+    'yaml': _load_yaml,
+}
+
+
+def _uses_natural_keys(data):
+    """
+    Returns True if parsed fixture data uses natural keys, which are resolved
+    against the database and can't be cached.
+    """
+    for item in data:
+        if 'pk' not in item:
+            return True
+        model = _get_model(item['model'])
+        fields = item.get('fields', {})
+        for field in model._meta.fields:
+            related = (getattr(field, 'remote_field', None) or
+                       getattr(field, 'rel', None))
+            if (related is not None and
+                    isinstance(fields.get(field.name), (list, tuple))):
+                return True
+        for field in model._meta.many_to_many:
+            if any(isinstance(value, (list, tuple))
+                   for value in fields.get(field.name) or ()):
+                return True
+    return False
+
+
+def get_fixture_objects(label, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the deserialized objects for a fixture label, parsing the fixture
+    files only when they changed since the last call. Returns None if the
+    label can't be resolved without loaddata, which includes fixtures using
+    natural keys.
+    """
+    files = find_fixture_files(label, using=using)
+    if files is None:
+        return None
+
+    mtimes = dict((path, os.path.getmtime(path)) for path, fmt in files)
+    cached = _fixture_cache.get((label, using))
+    if cached is not None and cached[0] == mtimes:
+        return cached[1]
+
+    data = []
+    for path, fmt in files:
+        with open(path, 'r') as fixture:
+            data.extend(_LOADERS[fmt](fixture) or ())
+    try:
+        if _uses_natural_keys(data):
+            return None
+        # Without natural keys, deserializing never queries the database.
+        objects = list(PythonDeserializer(data, using=using))
+    except (DeserializationError, AttributeError, KeyError, TypeError):
+        # Let loaddata report malformed fixtures.
+        return None
+    _fixture_cache[(label, using)] = (mtimes, objects)
+    return objects
+
+
+def replay_fixture_objects(objects, using=DEFAULT_DB_ALIAS):
+    """
+    Inserts previously deserialized fixture objects. Runs of objects of the
+    same model are inserted with bulk_create(), objects with many-to-many
+    data or inherited models are saved one at a time. Like loaddata, the
+    pre_save and post_save signals are sent with raw=True.
+    """
+    connection = connections[using]
+    models = set()
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        model = batch[0].__class__
+        if pre_save.has_listeners(model):
+            for obj in batch:
+                pre_save.send(sender=model, instance=obj, raw=True,
+                              using=using, update_fields=None)
+        model._default_manager.using(using).bulk_create(batch)
+        if post_save.has_listeners(model):
+            for obj in batch:
+                post_save.send(sender=model, instance=obj, created=True,
+                               update_fields=None, raw=True, using=using)
+        del batch[:]
+
+    with connection.constraint_checks_disabled():
+        for deserialized in objects:
+            model = deserialized.object.__class__
+            if not _allow_load(using, model):
+                continue
+            models.add(model)
+
+            if deserialized.m2m_data or model._meta.parents:
+                flush()
+                deserialized.save(using=using)
+                continue
+
+            if batch and batch[0].__class__ is not model:
+                flush()
+            # Copy the instance (and its state), it is replayed for every
+            # test case using this fixture.
+            obj = copy.copy(deserialized.object)
+            obj._state = copy.copy(obj._state)
+            batch.append(obj)
+        flush()
+
+    if models:
+        connection.check_constraints(
+            table_names=[model._meta.db_table for model in models])
+
+        sql = connection.ops.sequence_reset_sql(no_style(), models)
+        if sql:
+            cursor = connection.cursor()
+            try:
+                for line in sql:
+                    cursor.execute(line)
+            finally:
+                cursor.close()
+
+
+def load_fixtures(fixtures, using=DEFAULT_DB_ALIAS):
+    """
+    Loads fixtures into a database, replaying cached objects where possible
+    and falling back to loaddata otherwise.
+    """
+    objects = []
+    for label in fixtures:
+        fixture_objects = get_fixture_objects(label, using=using)
+        if fixture_objects is None:
+            options = {'verbosity': 0, 'database': using}
+            if _atomic is None:
+                # Django < 1.6 commits unless told otherwise.
+                options['commit'] = False
+            call_command('loaddata', *fixtures, **options)
+            return
+        objects.extend(fixture_objects)
+    replay_fixture_objects(objects, using=using)
+
+
 if _atomic != atomic:
 
     # If we are using our backported atomic decorator, then we must augment
@@ -61,31 +283,33 @@ if _atomic != atomic:
         if not connections_support_transactions():
             return
 
-        cls.cls_atomics = cls._enter_atomics()
-
-        if getattr(cls, 'fixtures', None) is not None:
-            for db_name in cls._databases_names(include_mirrors=False):
-                try:
-                    call_command('loaddata', *cls.fixtures, **{
-                        'verbosity': 0,
-                        'commit': False,
-                        'database': db_name,
-                    })
-                except Exception:
-                    cls._rollback_atomics(cls.cls_atomics)
-                    raise
+        # Durable blocks in tests are nested in the test case's blocks.
+        Atomic._ensure_durability = False
+        ready = False
         try:
-            cls.setUpTestData()
-        except Exception:
-            cls._rollback_atomics(cls.cls_atomics)
-            raise
+            cls.cls_atomics = cls._enter_atomics()
+            try:
+                if getattr(cls, 'fixtures', None) is not None:
+                    for db_name in cls._databases_names(include_mirrors=False):
+                        load_fixtures(cls.fixtures, using=db_name)
+                cls.setUpTestData()
+            except Exception:
+                cls._rollback_atomics(cls.cls_atomics)
+                raise
+            ready = True
+        finally:
+            if not ready:
+                Atomic._ensure_durability = True
 
     @classmethod
     def tearDownClass(cls):
         if connections_support_transactions():
-            cls._rollback_atomics(cls.cls_atomics)
-            for conn in connections.all():
-                conn.close()
+            try:
+                cls._rollback_atomics(cls.cls_atomics)
+                for conn in connections.all():
+                    conn.close()
+            finally:
+                Atomic._ensure_durability = True
         super(TestCase, cls).tearDownClass()
 
     @classmethod
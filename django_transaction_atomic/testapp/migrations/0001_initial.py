@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Model1',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=120)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProxyModel1',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+            },
+            bases=('testapp.model1',),
+        ),
+    ]
@@ -0,0 +1,11 @@
+# Models used by the tests only, kept out of the shipped migrations.
+from django.db import models
+
+
+class Model1(models.Model):
+    name = models.CharField(max_length=120)
+
+
+class ProxyModel1(Model1):
+    class Meta:
+        proxy = True
@@ -5,8 +5,24 @@ except ImportError:
     from django import __version__ as django_version
     django_version = list(map(int, django_version.split('.')[:2]))
 
-from django.db import connection
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db import connection, connections, DatabaseError
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils.six import StringIO
+from django.core.management import call_command
+from django.db.transaction import TransactionManagementError
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from unittest import skipIf
 
@@ -16,9 +32,26 @@ try:
 except ImportError:
     import mock
 
-from . import atomic, commit, rollback
-from .test import connections_support_transactions
-from .models import Model1
+from . import Atomic, atomic, cached_get, commit, rollback
+from . import _atomic, _compat
+from ._cache import ReadCache
+from .chunks import atomic_chunks, process_chunks
+from .groupcommit import GroupCommitExecutor
+from .locks import (
+    LOCK_TABLE, LockTimeoutError, acquire_lock, get_lock_stats, lock_rows,
+    release_lock, reset_lock_stats
+)
+from .routers import (
+    StickyPrimaryRouter, clear_pins, is_pinned, record_commit
+)
+from .test import (
+    connections_support_transactions, get_fixture_objects, load_fixtures
+)
+from .models import OutboxMessage
+from .testapp.models import Model1, ProxyModel1
+from .outbox import enqueue, register_handler, relay, run_relay
+from .replay import replay, synthesize
+from .trace import Redactor, shape, start_recording, stop_recording
 
 
 def _supports_atomic():
@@ -42,15 +75,25 @@ class DefaultTestCase(TransactionTestCase):
     def test_import(self):
         """Test that patching was done."""
         # Import "real" implementation.
-        from django.db.transaction import atomic as _atomic
+        from django.db.transaction import Atomic as _Atomic
         from django.db.transaction import commit as _commit
         from django.db.transaction import rollback as _rollback
 
         # Ensure the originals are used.
-        self.assertEqual(atomic, _atomic)
+        self.assertIsInstance(atomic(), _Atomic)
         self.assertEqual(commit, _commit)
         self.assertEqual(rollback, _rollback)
 
+    def test_extensions(self):
+        """Test that extensions use our implementation."""
+        self.assertIsInstance(atomic(durable=True), _atomic.Atomic)
+
+        @atomic(durable=True)
+        def function():
+            _function()
+
+        function()
+
 
 @skipIf(_supports_atomic(), 'Atomic support is built in')
 class BackportTestCase(TestCase):
@@ -194,3 +237,794 @@ class CrossVersionTransactionTestCase(TransactionTestCase):
             new()
 
         self.assertEqual(0, Model1.objects.all().count())
+
+
+class FixtureCacheTestCase(TestCase):
+    """
+    Test Case for the fixture cache used by setUpClass.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'models.json')
+        with open(self.path, 'w') as f:
+            f.write('[{"model": "testapp.model1", "pk": 1, '
+                    '"fields": {"name": "one"}}, '
+                    '{"model": "testapp.model1", "pk": 2, '
+                    '"fields": {"name": "two"}}]')
+        self.label = os.path.join(self.tmpdir, 'models')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache_hit(self):
+        """Test that unchanged fixtures are only parsed once."""
+        objects = get_fixture_objects(self.label)
+        self.assertEqual(2, len(objects))
+        self.assertIs(objects, get_fixture_objects(self.label))
+
+    def test_cache_mtime(self):
+        """Test that modified fixtures are parsed again."""
+        objects = get_fixture_objects(self.label)
+        mtime = os.path.getmtime(self.path) + 10
+        os.utime(self.path, (mtime, mtime))
+        self.assertIsNot(objects, get_fixture_objects(self.label))
+
+    def test_replay(self):
+        """Test that cached objects can be loaded more than once."""
+        with atomic():
+            load_fixtures([self.label])
+            self.assertEqual(2, Model1.objects.all().count())
+            Model1.objects.all().delete()
+            load_fixtures([self.label])
+            self.assertEqual(
+                ['one', 'two'],
+                list(Model1.objects.order_by('pk')
+                     .values_list('name', flat=True)))
+
+    def test_signals(self):
+        """Test that raw save signals are sent for replayed objects."""
+        received = []
+
+        def receiver(signal, instance, raw, **kwargs):
+            received.append((signal, instance.pk, raw))
+
+        for signal in (pre_save, post_save):
+            signal.connect(receiver, sender=Model1)
+            self.addCleanup(signal.disconnect, receiver, sender=Model1)
+        load_fixtures([self.label])
+
+        self.assertEqual(
+            [(pre_save, 1, True), (pre_save, 2, True),
+             (post_save, 1, True), (post_save, 2, True)], received)
+
+    def test_unresolved(self):
+        """Test that unknown labels are left to loaddata."""
+        self.assertIsNone(get_fixture_objects('does-not-exist'))
+        self.assertIsNone(get_fixture_objects(self.label + '.json.gz'))
+
+    def test_app_fixture(self):
+        """Test that fixtures are found in the apps' fixtures directories."""
+        load_fixtures(['model1'])
+        self.assertEqual(2, Model1.objects.all().count())
+
+    def test_natural_keys(self):
+        """Test that fixtures using natural keys are left to loaddata."""
+        with open(self.path, 'w') as f:
+            f.write('[{"model": "testapp.model1", '
+                    '"fields": {"name": "one"}}]')
+        self.assertIsNone(get_fixture_objects(self.label))
+
+        load_fixtures([self.label])
+        self.assertEqual(['one'],
+                         list(Model1.objects.values_list('name', flat=True)))
+
+    def test_database_specific(self):
+        """Test that database specific fixture files are left to loaddata."""
+        shutil.copy(self.path,
+                    os.path.join(self.tmpdir, 'models.default.json'))
+        self.assertIsNone(get_fixture_objects(self.label))
+
+
+class FixturesTestCase(TestCase):
+    """
+    Test Case for the fixtures loaded by setUpClass.
+    """
+    fixtures = ['model1']
+
+    def test_loaded(self):
+        """Test that the fixtures were loaded."""
+        self.assertEqual(
+            ['fixture one', 'fixture two'],
+            list(Model1.objects.order_by('pk').values_list('name', flat=True)))
+
+
+class ReadCacheTestCase(TestCase):
+    """
+    Test Case for the transaction-scoped read cache.
+    """
+
+    def test_lru(self):
+        """Test that the least recently used instance is evicted."""
+        cache = ReadCache(max_size=2)
+        cache.set(Model1, 1, 'one')
+        cache.set(Model1, 2, 'two')
+        cache.get(Model1, 1)
+        cache.set(Model1, 3, 'three')
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(Model1, 2))
+        self.assertEqual('one', cache.get(Model1, 1))
+
+    def test_rollback(self):
+        """Test that writes in a rolled back block are invalidated."""
+        cache = ReadCache()
+        cache.enter_block()
+        cache.enter_block()
+        cache.written(Model1)
+        cache.set(Model1, 1, 'one')
+        cache.exit_block(committed=False)
+        self.assertIsNone(cache.get(Model1, 1))
+
+        # Committed writes are rolled back with the enclosing block.
+        cache.enter_block()
+        cache.written(Model1)
+        cache.exit_block(committed=True)
+        cache.set(Model1, 1, 'one')
+        cache.exit_block(committed=False)
+        self.assertIsNone(cache.get(Model1, 1))
+
+
+class CacheReadsTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for atomic(cache_reads=True).
+    """
+
+    def test_cached_get(self):
+        """Test that repeated lookups are served from the cache."""
+        pk = Model1.objects.create(name='cached').pk
+
+        with atomic(cache_reads=True):
+            obj = cached_get(Model1, pk)
+            with self.assertNumQueries(0):
+                self.assertIs(obj, cached_get(Model1, str(pk)))
+
+            # Saving invalidates the model.
+            obj.save()
+            self.assertIsNot(obj, cached_get(Model1, pk))
+
+        self.assertIsNone(connection.read_cache)
+        with self.assertNumQueries(1):
+            cached_get(Model1, pk)
+
+    def test_nested_rollback(self):
+        """Test that a plain nested block rolling back invalidates."""
+        pk = Model1.objects.create(name='orig').pk
+
+        with atomic(cache_reads=True):
+            cached_get(Model1, pk)
+            with self.assertRaises(Exception):
+                with atomic():
+                    obj = Model1.objects.get(pk=pk)
+                    obj.name = 'rolled back'
+                    obj.save()
+                    self.assertEqual('rolled back',
+                                     cached_get(Model1, pk).name)
+                    raise Exception()
+
+            self.assertEqual('orig', cached_get(Model1, pk).name)
+
+
+@override_settings(ATOMIC_REPLICA_DATABASES=['replica'])
+class StickyPrimaryRouterTestCase(TransactionTestCase):
+    """
+    Test Case for pinning reads to the primary after a commit.
+    """
+
+    def setUp(self):
+        self.router = StickyPrimaryRouter()
+        clear_pins()
+
+    def test_unpinned(self):
+        """Test that reads go to replicas by default."""
+        self.assertEqual('replica', self.router.db_for_read(Model1))
+        self.assertEqual('default', self.router.db_for_write(Model1))
+
+    def test_commit(self):
+        """Test that models written in an atomic block are pinned."""
+        with atomic():
+            Model1.objects.create(name='pin me')
+            # Reads in the transaction see its writes.
+            self.assertEqual('default', self.router.db_for_read(Model1))
+        self.assertTrue(is_pinned(Model1))
+
+        clear_pins()
+        self.assertEqual('replica', self.router.db_for_read(Model1))
+
+    def test_extensions(self):
+        """Test that writes in our atomic blocks pin as well."""
+        with atomic(durable=True):
+            Model1.objects.create(name='pin me')
+            self.assertFalse(is_pinned(Model1))
+        self.assertTrue(is_pinned(Model1))
+
+    def test_autocommit(self):
+        """Test that writes outside of atomic blocks are pinned."""
+        Model1.objects.create(name='pin me')
+        self.assertEqual('default', self.router.db_for_read(Model1))
+
+    def test_rollback(self):
+        """Test that rolled back writes do not pin."""
+        for kwargs in ({}, {'durable': True}):
+            with self.assertRaises(Exception):
+                with atomic(**kwargs):
+                    Model1.objects.create(name='I should be rolled back.')
+                    raise Exception()
+
+            self.assertEqual('replica', self.router.db_for_read(Model1))
+
+    @override_settings(ATOMIC_PIN_SECONDS=5)
+    def test_window(self):
+        """Test that pins expire."""
+        with mock.patch('time.time', return_value=100):
+            record_commit('default', [Model1])
+            self.assertEqual('default', self.router.db_for_read(Model1))
+        with mock.patch('time.time', return_value=105):
+            self.assertEqual('replica', self.router.db_for_read(Model1))
+
+    def test_other_database(self):
+        """Test that commits on other databases do not pin."""
+        record_commit('replica', [Model1])
+        self.assertEqual('replica', self.router.db_for_read(Model1))
+
+    def test_not_installed(self):
+        """Test that writes are only tracked once the router is created."""
+        for signal in (post_save, post_delete):
+            signal.disconnect(dispatch_uid='django_transaction_atomic.routers')
+        Model1.objects.create(name='pin me')
+        self.assertFalse(is_pinned(Model1))
+
+        StickyPrimaryRouter()
+        Model1.objects.create(name='pin me')
+        self.assertTrue(is_pinned(Model1))
+
+    def test_on_commit(self):
+        """Test that a transaction pins once, however many writes it has."""
+        with mock.patch('django_transaction_atomic._atomic.record_commit') \
+                as record:
+            with atomic():
+                for i in range(3):
+                    Model1.objects.create(name='pin me')
+        record.assert_called_once_with('default', set([Model1]))
+
+
+class ChunksTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for chunked processing.
+    """
+
+    def test_chunks(self):
+        """Test that each chunk is committed on its own."""
+        checkpoints = []
+        with self.assertRaises(Exception):
+            for chunk in atomic_chunks(range(5), size=2,
+                                       checkpoint=checkpoints.append):
+                for i in chunk:
+                    Model1.objects.create(name=str(i))
+                if 4 in chunk:
+                    raise Exception()
+
+        self.assertEqual([2, 4], checkpoints)
+        self.assertEqual(4, Model1.objects.all().count())
+
+    def test_break(self):
+        """Test that closing the chunks after a break rolls back the chunk."""
+        with closing(atomic_chunks(range(5), size=2)) as chunks:
+            for chunk in chunks:
+                for i in chunk:
+                    Model1.objects.create(name=str(i))
+                if 2 in chunk:
+                    break
+            # Still referenced: the transaction of the chunk is open.
+            self.assertTrue(connection.in_atomic_block)
+        self.assertFalse(connection.in_atomic_block)
+
+        self.assertEqual(['0', '1'], sorted(
+            Model1.objects.values_list('name', flat=True)))
+
+    def test_prefetch(self):
+        """Test that prefetching yields the same chunks."""
+        chunks = list(atomic_chunks(range(5), size=2, prefetch=True))
+        self.assertEqual([[0, 1], [2, 3], [4]], chunks)
+
+        # Stopping early does not hang.
+        for chunk in atomic_chunks(range(50), size=2, prefetch=True):
+            break
+
+    def test_start(self):
+        """Test resuming from a checkpoint."""
+        self.assertEqual(
+            [[3, 4], [5]], list(atomic_chunks(range(6), size=2, start=3)))
+
+    def test_retry(self):
+        """Test that deadlocked chunks are retried."""
+        calls = []
+
+        def func(chunk):
+            calls.append(chunk)
+            if len(calls) == 1:
+                raise DatabaseError(1213, 'Deadlock found')
+
+        with mock.patch('time.sleep'):
+            self.assertEqual(3, process_chunks(func, range(3), size=5))
+        self.assertEqual([[0, 1, 2], [0, 1, 2]], calls)
+
+    def test_nested(self):
+        """Test that chunks can not be nested in a transaction."""
+        with atomic():
+            with self.assertRaises(TransactionManagementError):
+                process_chunks(list, range(3))
+
+
+class DurableTestCase(TestCase):
+    """
+    Test Case for atomic(durable=True) inside the test case's blocks.
+    """
+
+    def test_durable(self):
+        """Test that durable blocks can be used in tests."""
+        with atomic(durable=True):
+            Model1.objects.create(name='durable')
+        self.assertEqual(1, Model1.objects.all().count())
+
+    def test_setup_failure(self):
+        """Test that durability is restored when setUpClass fails."""
+        class FailingTestCase(TestCase):
+            @classmethod
+            def setUpTestData(cls):
+                raise ValueError()
+
+        _atomic.Atomic._ensure_durability = True
+        with mock.patch.object(FailingTestCase, '_enter_atomics',
+                               side_effect=ValueError(), create=True):
+            with self.assertRaises(ValueError):
+                FailingTestCase.setUpClass()
+        self.assertTrue(_atomic.Atomic._ensure_durability)
+        _atomic.Atomic._ensure_durability = False
+
+
+class DurableTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for atomic(durable=True).
+    """
+
+    def test_outermost(self):
+        """Test that a durable block can be the outermost block."""
+        with atomic(durable=True):
+            Model1.objects.create(name='durable')
+        self.assertEqual(1, Model1.objects.all().count())
+
+    def test_nested(self):
+        """Test that durable blocks can not be nested."""
+        with atomic():
+            with self.assertRaises(TransactionManagementError):
+                with atomic(durable=True):
+                    pass
+
+    @override_settings(DEBUG=True)
+    def test_entry_stack(self):
+        """Test that the outermost block's stack is reported in DEBUG."""
+        with atomic():
+            with self.assertRaises(TransactionManagementError) as cm:
+                with atomic(durable=True):
+                    pass
+        self.assertIn('test_entry_stack', str(cm.exception))
+
+
+class LockTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for atomic(lock=...).
+    """
+
+    def setUp(self):
+        reset_lock_stats()
+
+    def _held(self):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT name FROM %s' % LOCK_TABLE)
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def test_lock(self):
+        """Test that the lock is held for the life of the block."""
+        with atomic(lock='tenant:42'):
+            self.assertEqual(['tenant:42'], self._held())
+        self.assertEqual([], self._held())
+        self.assertEqual(1, get_lock_stats()['acquired'])
+
+    def test_exception(self):
+        """Test that the lock is released when the block raises."""
+        with self.assertRaises(Exception):
+            with atomic(lock='tenant:42'):
+                raise Exception()
+        self.assertEqual([], self._held())
+
+    def test_timeout(self):
+        """Test that a held lock times out."""
+        holder = _atomic.get_connection()
+        acquire_lock(holder, 'tenant:42')
+        try:
+            with self.assertRaises(LockTimeoutError):
+                with atomic(lock='tenant:42', lock_timeout=0):
+                    pass
+        finally:
+            release_lock(holder, 'tenant:42')
+        self.assertEqual(1, get_lock_stats()['timeouts'])
+
+    def test_closed(self):
+        """Test that the lock is released when the connection is unusable."""
+        holder = _atomic.get_connection()
+        acquire_lock(holder, 'tenant:42')
+        with mock.patch.object(connections['default'], 'cursor',
+                               side_effect=DatabaseError()):
+            release_lock(holder, 'tenant:42')
+        self.assertEqual([], self._held())
+
+    @override_settings(ATOMIC_LOCK_EXPIRY=60)
+    def test_expired(self):
+        """Test that locks left behind by crashed processes expire."""
+        holder = _atomic.get_connection()
+        with mock.patch('time.time', return_value=100):
+            acquire_lock(holder, 'tenant:42')
+        with atomic(lock='tenant:42', lock_timeout=0):
+            self.assertEqual(['tenant:42'], self._held())
+        self.assertEqual([], self._held())
+
+    def test_not_expired(self):
+        """Test that locks never expire by default."""
+        holder = _atomic.get_connection()
+        with mock.patch('time.time', return_value=100):
+            acquire_lock(holder, 'tenant:42')
+        try:
+            with self.assertRaises(LockTimeoutError):
+                with atomic(lock='tenant:42', lock_timeout=0):
+                    pass
+        finally:
+            release_lock(holder, 'tenant:42')
+
+    def test_nested(self):
+        """Test that locked blocks can not be nested."""
+        with atomic():
+            with self.assertRaises(TransactionManagementError):
+                with atomic(lock='tenant:42'):
+                    pass
+
+
+class LockRowsTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for ordered row locking.
+    """
+
+    def test_lock_rows(self):
+        """Test that rows are locked once per transaction."""
+        pks = [Model1.objects.create(name=str(i)).pk for i in range(3)]
+
+        with Atomic(None, savepoint=True):
+            with self.assertNumQueries(1):
+                self.assertEqual(2, lock_rows([(Model1, pks[1]),
+                                               (Model1, pks[0])]))
+            with atomic():
+                self.assertEqual(1, lock_rows([(Model1, str(pk))
+                                               for pk in pks]))
+            with self.assertNumQueries(0):
+                self.assertEqual(0, lock_rows([(Model1, pks[2])]))
+
+        self.assertIsNone(connection.locked_rows)
+
+    def test_proxy(self):
+        """Test that proxy models lock the rows of their concrete model."""
+        pk = Model1.objects.create(name='proxied').pk
+
+        with Atomic(None, savepoint=True):
+            with self.assertNumQueries(1):
+                self.assertEqual(1, lock_rows([(ProxyModel1, pk),
+                                               (Model1, pk)]))
+            self.assertEqual(0, lock_rows([(ProxyModel1, pk)]))
+
+    def test_builtin_atomic(self):
+        """Test that rows are locked once in Django's blocks as well."""
+        pks = [Model1.objects.create(name=str(i)).pk for i in range(2)]
+
+        with atomic():
+            self.assertEqual(2, lock_rows([(Model1, pk) for pk in pks]))
+            with atomic():
+                self.assertEqual(0, lock_rows([(Model1, pk) for pk in pks]))
+
+        self.assertIsNone(connection.locked_rows)
+
+    def test_outside_atomic(self):
+        """Test that rows can only be locked in a transaction."""
+        with self.assertRaises(TransactionManagementError):
+            lock_rows([(Model1, 1)])
+
+
+class GroupCommitTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for the group commit executor.
+    """
+
+    def test_batch(self):
+        """Test that submitted callables commit together."""
+        with GroupCommitExecutor(max_batch=3, max_latency=5) as executor:
+            futures = [executor.submit(Model1.objects.create, name=str(i))
+                       for i in range(3)]
+            names = [future.result(timeout=5).name for future in futures]
+
+        self.assertEqual(['0', '1', '2'], names)
+        self.assertEqual(3, Model1.objects.all().count())
+
+    def test_failure(self):
+        """Test that a failing callable reports its own exception."""
+        def fail():
+            raise ValueError()
+
+        with GroupCommitExecutor() as executor:
+            future = executor.submit(fail)
+            with self.assertRaises(ValueError):
+                future.result(timeout=5)
+
+        with self.assertRaises(RuntimeError):
+            executor.submit(fail)
+
+    def test_partial_failure(self):
+        """Test that only the failing callable is rolled back."""
+        def fail():
+            Model1.objects.create(name='I should be rolled back.')
+            raise ValueError()
+
+        with GroupCommitExecutor(max_batch=2, max_latency=5) as executor:
+            failed = executor.submit(fail)
+            created = executor.submit(Model1.objects.create, name='created')
+            with self.assertRaises(ValueError):
+                failed.result(timeout=5)
+            created.result(timeout=5)
+
+        self.assertEqual(['created'],
+                         list(Model1.objects.values_list('name', flat=True)))
+
+    def test_begin_failure(self):
+        """Test that every future fails when the transaction can't begin."""
+        with mock.patch.object(_atomic.Atomic, '_enter',
+                               side_effect=DatabaseError()):
+            with GroupCommitExecutor(max_batch=2, max_latency=5) as executor:
+                futures = [executor.submit(Model1.objects.create, name=str(i))
+                           for i in range(2)]
+                for future in futures:
+                    with self.assertRaises(DatabaseError):
+                        future.result(timeout=5)
+
+
+class OutboxTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for the transactional outbox.
+    """
+
+    def test_rollback(self):
+        """Test that messages are only written if the block commits."""
+        with self.assertRaises(Exception):
+            with atomic():
+                enqueue('test.rollback', {'id': 1})
+                raise Exception()
+
+        self.assertEqual(0, OutboxMessage.objects.all().count())
+
+    def test_relay(self):
+        """Test that the relay delivers and marks messages."""
+        received = []
+        register_handler('test.relay', received.append)
+        with atomic():
+            for i in range(3):
+                enqueue('test.relay', {'id': i})
+
+        call_command('outbox_relay', once=True, batch_size=2)
+        self.assertEqual([0, 1, 2],
+                         sorted(payload['id'] for payload in received))
+        self.assertEqual(0, OutboxMessage.objects.filter(
+            delivered__isnull=True).count())
+
+    def test_failure(self):
+        """Test that failed messages are retried."""
+        @register_handler('test.failure')
+        def fail(payload):
+            raise Exception()
+
+        enqueue('test.failure', None)
+        with mock.patch('django_transaction_atomic.outbox.logger'):
+            self.assertEqual(1, relay(max_attempts=2, retry_delay=0))
+            self.assertEqual(1, relay(max_attempts=2, retry_delay=0))
+        self.assertEqual(0, relay(max_attempts=2, retry_delay=0))
+        self.assertEqual(2, OutboxMessage.objects.get().attempts)
+
+    def test_retry_delay(self):
+        """Test that failed messages are not retried before their delay."""
+        @register_handler('test.delay')
+        def fail(payload):
+            raise Exception()
+
+        enqueue('test.delay', None)
+        now = timezone.now()
+        with mock.patch('django_transaction_atomic.outbox.logger'):
+            with mock.patch('django.utils.timezone.now', return_value=now):
+                self.assertEqual(1, relay(retry_delay=60))
+                self.assertEqual(0, relay(retry_delay=60))
+            later = now + timedelta(seconds=61)
+            with mock.patch('django.utils.timezone.now', return_value=later):
+                self.assertEqual(1, relay(retry_delay=60))
+                # The delay doubled.
+                self.assertEqual(0, relay(retry_delay=60))
+        self.assertEqual(2, OutboxMessage.objects.get().attempts)
+
+    def test_pool(self):
+        """Test that the relay's threads are stopped when it returns."""
+        register_handler('test.pool', lambda payload: Model1.objects.count())
+        for i in range(3):
+            enqueue('test.pool', {'id': i})
+
+        threads = threading.active_count()
+        run_relay(once=True, workers=2, batch_size=2)
+        self.assertEqual(threads, threading.active_count())
+        self.assertEqual(0, OutboxMessage.objects.filter(
+            delivered__isnull=True).count())
+
+
+class TimeoutTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for atomic(statement_timeout=..., lock_wait_timeout=...).
+    """
+
+    def test_busy_timeout(self):
+        """Test that the SQLite busy timeout is set and restored."""
+        proxy = _atomic.get_connection()
+        previous = proxy.get_session_variable('busy_timeout')
+
+        with atomic(lock_wait_timeout=2, statement_timeout=1):
+            proxy.session_variables = None
+            self.assertEqual(2000, proxy.get_session_variable('busy_timeout'))
+
+        proxy.session_variables = None
+        self.assertEqual(previous, proxy.get_session_variable('busy_timeout'))
+
+    def test_enter_failure(self):
+        """Test that timeouts are restored when the block fails to begin."""
+        proxy = _atomic.get_connection()
+        previous = proxy.get_session_variable('busy_timeout')
+
+        with mock.patch.object(_compat.ProxyDatabaseWrapper, 'set_autocommit',
+                               side_effect=DatabaseError()):
+            with self.assertRaises(DatabaseError):
+                with atomic(lock_wait_timeout=2):
+                    pass
+
+        self.assertIsNone(proxy.atomic_timeouts)
+        proxy.session_variables = None
+        self.assertEqual(previous, proxy.get_session_variable('busy_timeout'))
+
+    def test_cached(self):
+        """Test that unchanged session variables are not set again."""
+        proxy = _atomic.get_connection()
+        proxy.set_session_variable('busy_timeout', 2000)
+        with self.assertNumQueries(0):
+            proxy.set_session_variable('busy_timeout', 2000)
+
+
+class TraceTransactionTestCase(TransactionTestCase):
+    """
+    Test Case for the transaction trace recorder and replayer.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'trace.jsonl')
+
+    def tearDown(self):
+        stop_recording()
+        shutil.rmtree(self.tmpdir)
+
+    def _record(self):
+        start_recording(self.path)
+        with atomic():
+            Model1.objects.create(name='secret')
+            try:
+                with atomic():
+                    Model1.objects.filter(pk=1).update(name='secret')
+                    raise Exception()
+            except Exception:
+                pass
+        stop_recording()
+
+    def test_record(self):
+        """Test that the nesting, statements and outcome are recorded."""
+        self._record()
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual(1, len(records))
+        self.assertEqual('commit', records[0]['outcome'])
+        kinds = [event[0] for event in records[0]['events']]
+        self.assertEqual('savepoint', kinds[-3])
+        self.assertEqual('rollback', kinds[-1])
+        self.assertNotIn('secret', json.dumps(records))
+
+    def test_replay(self):
+        """Test that a recorded trace can be replayed."""
+        self._record()
+        Model1.objects.all().delete()
+
+        stats = replay(self.path, concurrency=1, speedup=100)
+        self.assertEqual(1, stats['transactions'])
+        self.assertEqual(0, stats['errors'])
+        names = list(Model1.objects.values_list('name', flat=True))
+        self.assertEqual(1, len(names))
+        self.assertEqual(6, len(names[0]))
+        self.assertNotEqual('secret', names[0])
+
+    def test_extensions(self):
+        """Test that our atomic blocks are recorded as well."""
+        start_recording(self.path)
+        with atomic(durable=True):
+            Model1.objects.create(name='secret')
+            with atomic():
+                pass
+        stop_recording()
+
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(1, len(records))
+        kinds = [event[0] for event in records[0]['events']]
+        self.assertEqual(['savepoint', 'release'], kinds[-2:])
+
+    def test_no_savepoint(self):
+        """Test that blocks without a savepoint are not recorded."""
+        start_recording(self.path)
+        with atomic():
+            with atomic(savepoint=False):
+                Model1.objects.create(name='secret')
+            with Atomic(None, savepoint=False):
+                pass
+        stop_recording()
+
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(1, len(records))
+        kinds = [event[0] for event in records[0]['events']]
+        self.assertNotIn('savepoint', kinds)
+        self.assertNotIn('release', kinds)
+
+    def test_synthesize(self):
+        """Test that redacted parameters replay with the same type."""
+        redactor = Redactor()
+        params = [None, True, 12345, Decimal('-12.50'), 2.5, b'\x00\x01',
+                  u'555-0100', u'2026-10-19 12:34:56.123456', u'2026-10-19',
+                  date(2026, 10, 19), uuid.uuid4(), [1, 2]]
+        redacted = [redactor(param) for param in params]
+        self.assertNotIn('555', json.dumps(redacted))
+        self.assertNotIn('12345', json.dumps(redacted))
+
+        values = [synthesize(param) for param in redacted]
+        for param, value in zip(params, values):
+            self.assertIs(type(param), type(value))
+        self.assertEqual(5, len(str(values[2])))
+        self.assertEqual(-2, values[3].as_tuple().exponent)
+        self.assertEqual('999-9999', shape(values[6]))
+        datetime.strptime(values[7], '%Y-%m-%d %H:%M:%S.%f')
+        datetime.strptime(values[8], '%Y-%m-%d')
+        self.assertEqual(values[2], synthesize(redactor(12345)))
+
+    def test_command(self):
+        """Test that the replay command reports its results."""
+        self._record()
+        stdout = StringIO()
+        call_command('replay_trace', self.path, concurrency=1, speedup=100,
+                     stdout=stdout)
+        self.assertIn('Transactions: 1', stdout.getvalue())
@@ -0,0 +1,252 @@
+# Transaction trace recorder, for load testing. See replay for the replayer.
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import hashlib
+import hmac
+import json
+import math
+import numbers
+import os
+import threading
+import time
+import types
+import uuid
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+_recorder = None
+
+
+# Statements issued by Atomic for savepoints, recorded as events instead.
+SAVEPOINT_STATEMENTS = ('SAVEPOINT ', 'RELEASE SAVEPOINT ',
+                        'ROLLBACK TO SAVEPOINT ')
+
+
+def shape(text):
+    """
+    Returns `text` with its digits replaced by 9 and its letters by a or A.
+    """
+    return ''.join('9' if c.isdigit() else
+                   ('A' if c.isupper() else 'a') if c.isalpha() else c
+                   for c in text)
+
+
+class Redactor(object):
+    """
+    Replaces each parameter by its type and shape (length, digits, ...) and a
+    token, equal for equal values within a recording but meaningless without
+    its random key. The replayer turns them into synthetic values of the same
+    type and shape, see replay.synthesize().
+    """
+
+    def __init__(self, key=None):
+        self.key = os.urandom(16) if key is None else key
+
+    def token(self, param):
+        digest = hmac.new(self.key, repr(param).encode('utf-8'),
+                          hashlib.sha256)
+        return digest.hexdigest()[:16]
+
+    def __call__(self, param):
+        if param is None:
+            return None
+        if isinstance(param, (list, tuple)):
+            return {'type': 'list', 'items': [self(item) for item in param]}
+
+        redacted = {'type': 'str', 'token': self.token(param)}
+        if isinstance(param, bool):
+            redacted['type'] = 'bool'
+        elif isinstance(param, numbers.Integral):
+            redacted.update(type='int', shape=shape(str(param)))
+        elif isinstance(param, decimal.Decimal):
+            if not param.is_finite():
+                return {'type': 'decimal', 'value': str(param)}
+            redacted.update(type='decimal', shape=shape(format(param, 'f')))
+        elif isinstance(param, float):
+            if math.isinf(param) or math.isnan(param):
+                return {'type': 'float', 'value': str(param)}
+            redacted.update(type='float', shape=shape('%f' % param))
+        elif isinstance(param, (bytes, bytearray, memoryview)):
+            redacted.update(type='bytes', length=len(bytes(param)))
+        elif isinstance(param, datetime.datetime):
+            redacted.update(type='datetime', aware=param.tzinfo is not None)
+        elif isinstance(param, datetime.date):
+            redacted['type'] = 'date'
+        elif isinstance(param, datetime.time):
+            redacted['type'] = 'time'
+        elif isinstance(param, uuid.UUID):
+            redacted['type'] = 'uuid'
+        else:
+            redacted['shape'] = shape(param if isinstance(param, type(u''))
+                                      else str(param))
+        return redacted
+
+
+class TransactionTrace(object):
+    """
+    The events of one outermost transaction, with their offset in seconds
+    from its start:
+
+        ['savepoint', offset]
+        ['release', offset]
+        ['rollback', offset]
+        ['query', offset, sql, params, duration]
+    """
+
+    def __init__(self, recorder, using):
+        self.recorder = recorder
+        self.using = using
+        self.start = time.time()
+        self.events = []
+
+    def event(self, kind):
+        self.events.append([kind, time.time() - self.start])
+
+    def query(self, sql, params, start, duration):
+        if sql.startswith(SAVEPOINT_STATEMENTS):
+            return
+        redact = self.recorder.redact
+        if isinstance(params, dict):
+            params = dict((name, redact(param))
+                          for name, param in params.items())
+        elif params is not None:
+            params = [redact(param) for param in params]
+        self.events.append(['query', start - self.start, sql, params,
+                            duration])
+
+    def finish(self, committed):
+        self.recorder.write({
+            'using': self.using,
+            'start': self.start,
+            'duration': time.time() - self.start,
+            'outcome': 'commit' if committed else 'rollback',
+            'events': self.events,
+        })
+
+
+class TraceCursorWrapper(object):
+    """
+    Records the statements executed through a cursor.
+    """
+
+    def __init__(self, cursor, trace):
+        self.cursor = cursor
+        self.trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.trace.query(sql, params, start, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            # Recorded as one statement per set of parameters.
+            duration = (time.time() - start) / max(1, len(param_list))
+            for params in param_list:
+                self.trace.query(sql, params, start, duration)
+
+
+def _patch_cursor(connection):
+    # Patch the connection once; cursors are only wrapped while it has a
+    # trace.
+    if getattr(connection, '_trace_cursor', False):
+        return
+    cursor = connection.cursor
+
+    def traced_cursor(self, *args, **kwargs):
+        wrapped = cursor(*args, **kwargs)
+        trace = getattr(self, 'atomic_trace', None)
+        if trace is None:
+            return wrapped
+        return TraceCursorWrapper(wrapped, trace)
+
+    connection.cursor = types.MethodType(traced_cursor, connection)
+    connection._trace_cursor = True
+
+
+class TraceRecorder(object):
+    """
+    Writes transaction traces to a JSONL file, one transaction per line, from
+    a background thread.
+    """
+
+    def __init__(self, path, redact=None):
+        self.path = path
+        self.redact = Redactor() if redact is None else redact
+        self._queue = Queue()
+        self._file = open(path, 'a')
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def begin(self, connection):
+        _patch_cursor(connection._connection)
+        return TransactionTrace(self, connection.alias)
+
+    def write(self, record):
+        self._queue.put(record)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                self._file.write(json.dumps(record, default=str) + '\n')
+                if self._queue.empty():
+                    self._file.flush()
+        finally:
+            self._file.close()
+
+
+def get_recorder():
+    return _recorder
+
+
+def start_recording(path, redact=None):
+    """
+    Records the transactions of atomic blocks, in all threads, to `path`.
+
+    `redact` is called with each statement parameter and returns what is
+    written instead, a Redactor by default.
+    """
+    global _recorder
+    stop_recording()
+    _recorder = TraceRecorder(path, redact=redact)
+
+
+def stop_recording():
+    """
+    Stops recording and waits until the trace is written.
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
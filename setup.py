@@ -23,6 +23,9 @@ setup(
     ],
     packages=[
         "django_transaction_atomic",
+        "django_transaction_atomic.management",
+        "django_transaction_atomic.management.commands",
+        "django_transaction_atomic.migrations",
     ],
     classifiers=(
           'Development Status :: 4 - Beta',